@@ -1,13 +1,37 @@
 import os
+import re
 import csv
+import io
+import asyncio
 import requests
-import json
+import httpx
+import orjson
+import uuid
+import tempfile
+from aiolimiter import AsyncLimiter
 from dotenv import load_dotenv
 import logging
-from time import sleep
+from datetime import datetime, timedelta, timezone
 from urllib.parse import urlparse
+from contextlib import contextmanager
+from collections import deque
+from email.parser import BytesParser
 from google.oauth2 import service_account
 from google.auth.transport.requests import Request
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from tenacity import retry, retry_if_exception, stop_after_attempt
+
+try:
+    import pyarrow as pa
+    import pyarrow.csv as pacsv
+except ImportError:  # PyArrow не обязателен: без него CSV читается модулем csv
+    pa = pacsv = None
+
+try:
+    import uvloop
+except ImportError:  # uvloop недоступен на Windows, там работает стандартный цикл событий
+    uvloop = None
 
 # Загрузка переменных окружения
 load_dotenv()
@@ -22,6 +46,9 @@ logging.basicConfig(
     ]
 )
 logger = logging.getLogger(__name__)
+# httpx и httpcore пишут строку на каждый запрос; оставляем только предупреждения
+logging.getLogger("httpx").setLevel(logging.WARNING)
+logging.getLogger("httpcore").setLevel(logging.WARNING)
 
 # Константы Яндекса
 YANDEX_API_TOKEN = os.getenv("YANDEX_API_TOKEN")
@@ -43,11 +70,15 @@ YANDEX_HEADERS = {
 # Константы Google
 SERVICE_ACCOUNT_FILE = os.getenv("SERVICE_ACCOUNT_FILE")
 if not SERVICE_ACCOUNT_FILE or not os.path.exists(SERVICE_ACCOUNT_FILE):
-    logger.error(f"Файл учетных данных Google не найден: {SERVICE_ACCOUNT_FILE}")
+    logger.error("Файл учетных данных Google не найден: %s", SERVICE_ACCOUNT_FILE)
     raise ValueError(f"SERVICE_ACCOUNT_FILE не найден: {SERVICE_ACCOUNT_FILE}")
 
 SCOPES = ["https://www.googleapis.com/auth/indexing"]
-GOOGLE_API_BASE = "https://indexing.googleapis.com/v3/urlNotifications:publish"
+GOOGLE_BATCH_URL = "https://indexing.googleapis.com/batch"
+GOOGLE_PUBLISH_PATH = "/v3/urlNotifications:publish"
+GOOGLE_BATCH_SIZE = 100  # максимум вызовов в одном пакетном запросе
+GOOGLE_TOKEN_MARGIN = timedelta(seconds=60)  # запас до истечения токена
+GOOGLE_TOKEN_CACHE = os.getenv("GOOGLE_TOKEN_CACHE", ".token_cache.json")  # токен между запусками
 
 # Инициализация учетных данных Google
 try:
@@ -55,20 +86,176 @@ try:
         SERVICE_ACCOUNT_FILE, scopes=SCOPES
     )
 except Exception as e:
-    logger.error(f"Ошибка при загрузке учетных данных Google: {e}")
+    logger.error("Ошибка при загрузке учетных данных Google: %s", e)
     raise
 
+# Допустимый формат URL: некорректные адреса отсекаются до отправки в API
+URL_RE = re.compile(r"^https?://[^\s]+$")
+INVALID_URL_RESULT = (("неуспешно", "Некорректный URL"), ("неуспешно", "Некорректный URL"))
+
+# Временные ошибки API, при которых запрос повторяется с экспоненциальной паузой
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+RETRY_ATTEMPTS = 5
+RETRY_AFTER_MAX = 60  # секунд; при более долгом Retry-After запрос считается неуспешным сразу
+
+# HTTP-сессии: соединения и TLS-сессии переиспользуются между запросами
+HTTP_RETRY = Retry(
+    total=RETRY_ATTEMPTS,
+    backoff_factor=0.8,
+    status_forcelist=RETRY_STATUSES,
+    allowed_methods=("POST", "GET"),
+    respect_retry_after_header=True,
+    raise_on_status=False
+)
+
+yandex_session = requests.Session()
+yandex_session.headers.update(YANDEX_HEADERS)
+yandex_session.mount("https://", HTTPAdapter(pool_connections=4, pool_maxsize=20, max_retries=HTTP_RETRY))
+
+# Используется как транспорт для обновления токена Google
+google_session = requests.Session()
+google_session.mount("https://", HTTPAdapter(pool_connections=4, pool_maxsize=20, max_retries=HTTP_RETRY))
+
+# Параметры параллельной обработки
+CONCURRENCY = int(os.getenv("CONCURRENCY", "20"))  # одновременных запросов в работе
+# Квоты API: пока они не исчерпаны, запросы уходят пачкой, без пауз
+YANDEX_RATE_LIMIT = float(os.getenv("YANDEX_RATE_LIMIT", "10"))  # запросов в секунду
+GOOGLE_RATE_LIMIT = float(os.getenv("GOOGLE_RATE_LIMIT", "600"))  # URL в минуту
+# Лимитер не выдает за раз больше своей емкости, поэтому квоты меньше 1 недопустимы
+if CONCURRENCY < 1 or YANDEX_RATE_LIMIT < 1 or GOOGLE_RATE_LIMIT < 1:
+    logger.error("Некорректные параметры обработки: CONCURRENCY=%s, YANDEX_RATE_LIMIT=%s, GOOGLE_RATE_LIMIT=%s",
+                 CONCURRENCY, YANDEX_RATE_LIMIT, GOOGLE_RATE_LIMIT)
+    raise ValueError("CONCURRENCY, YANDEX_RATE_LIMIT и GOOGLE_RATE_LIMIT должны быть не меньше 1")
+
+# Пакет не больше минутной квоты Google, чтобы лимитер списывал его целиком
+GOOGLE_CHUNK_SIZE = min(GOOGLE_BATCH_SIZE, int(GOOGLE_RATE_LIMIT))
+# Сколько порций может быть в работе одновременно: Яндекс обрабатывает следующие
+# порции, пока Google ждет своей квоты. Результаты пишутся в порядке входного файла,
+# поэтому на длинном входе общий темп все равно определяет более медленный API
+PENDING_CHUNKS = int(os.getenv("PENDING_CHUNKS", "10"))
+if PENDING_CHUNKS < 1:
+    logger.error("Некорректный параметр обработки: PENDING_CHUNKS=%s", PENDING_CHUNKS)
+    raise ValueError("PENDING_CHUNKS должен быть не меньше 1")
+
+
+def utc_now():
+    """Текущее время UTC без часового пояса - в том же виде, что и credentials.expiry"""
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+
+def google_token_expiring():
+    """Проверяет, нужно ли обновить токен Google: его нет или он истекает в течение минуты"""
+    return (
+        not credentials.valid
+        or credentials.expiry is None
+        or credentials.expiry - utc_now() < GOOGLE_TOKEN_MARGIN
+    )
+
+
+def load_cached_token():
+    """Подставляет токен Google, сохраненный прошлым запуском, если он выдан тому же аккаунту и еще действует"""
+    try:
+        with open(GOOGLE_TOKEN_CACHE, mode="rb") as cache_file:
+            cache = orjson.loads(cache_file.read())
+        if not isinstance(cache, dict):
+            raise ValueError("ожидался JSON-объект")
+        if cache.get("account") != credentials.service_account_email:
+            return
+        token = cache["token"]
+        expiry = datetime.fromisoformat(cache["expiry"])
+        # credentials.expiry хранится в UTC без часового пояса
+        if not isinstance(token, str) or expiry.tzinfo is not None:
+            raise ValueError("некорректный токен или срок действия")
+        if expiry - utc_now() <= GOOGLE_TOKEN_MARGIN:
+            return
+    except FileNotFoundError:
+        return
+    except Exception as e:
+        # Испорченный кэш не мешает работе: токен будет получен заново и кэш перезаписан
+        logger.warning("Не удалось прочитать кэш токена Google: %s", e)
+        return
+
+    credentials.token = token
+    credentials.expiry = expiry
+    logger.info("Использован сохраненный токен Google, действует до %s", expiry)
+
+
+def save_cached_token():
+    """Сохраняет токен Google на диск (доступ только владельцу), чтобы следующий запуск не обновлял его"""
+    cache = {
+        "account": credentials.service_account_email,
+        "token": credentials.token,
+        "expiry": credentials.expiry.isoformat()
+    }
+    # Временный файл создается с правами 0600 и заменяет кэш целиком, поэтому
+    # токен не попадет в уже существующий файл с более широкими правами
+    tmp_path = None
+    try:
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(GOOGLE_TOKEN_CACHE)))
+        with os.fdopen(fd, mode="wb") as cache_file:
+            cache_file.write(orjson.dumps(cache))
+        os.replace(tmp_path, GOOGLE_TOKEN_CACHE)
+    except OSError as e:
+        logger.warning("Не удалось сохранить кэш токена Google: %s", e)
+        if tmp_path is not None and os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
 
 def get_access_token():
-    """Получает актуальный токен доступа Google API"""
+    """Получает актуальный токен доступа Google API, обновляя его только по истечении срока"""
     try:
-        credentials.refresh(Request())
+        if google_token_expiring():
+            credentials.refresh(Request(session=google_session))
+            logger.info("Токен Google обновлен, действует до %s", credentials.expiry)
+            save_cached_token()
         return credentials.token
     except Exception as e:
-        logger.error(f"Ошибка при получении токена Google: {e}")
+        logger.error("Ошибка при получении токена Google: %s", e)
         raise
 
 
+def invalidate_google_token():
+    """Сбрасывает токен Google и удаляет его кэш, если API отклонил токен раньше срока"""
+    credentials.token = None
+    credentials.expiry = None
+    try:
+        os.remove(GOOGLE_TOKEN_CACHE)
+    except FileNotFoundError:
+        pass
+    except OSError as e:
+        logger.warning("Не удалось удалить кэш токена Google: %s", e)
+
+
+async def ensure_google_token(client, lock):
+    """
+    Устанавливает действующий токен в заголовок Authorization сессии Google.
+    Блокировка не дает параллельным задачам обновлять токен одновременно
+    """
+    if "Authorization" in client.headers and not google_token_expiring():
+        return
+    async with lock:
+        # Пока ждали блокировку, токен мог обновить другой обработчик
+        if "Authorization" in client.headers and not google_token_expiring():
+            return
+        # Обновление токена блокирующее, поэтому выносим его из цикла событий
+        token = await asyncio.to_thread(get_access_token)
+        client.headers["Authorization"] = f"Bearer {token}"
+
+
+async def renew_google_token(client, lock, rejected_header):
+    """
+    Получает новый токен после ответа 401 на заголовок rejected_header.
+    Если отказ получили несколько задач, токен обновляется один раз
+    """
+    async with lock:
+        if client.headers.get("Authorization") != rejected_header:
+            return
+        logger.warning("Google отклонил токен доступа, получаем новый")
+        invalidate_google_token()
+        token = await asyncio.to_thread(get_access_token)
+        client.headers["Authorization"] = f"Bearer {token}"
+
+
 def build_yandex_host_id(site_url):
     """Формирует host_id в формате 'https:example.com:443'"""
     try:
@@ -81,212 +268,519 @@ def build_yandex_host_id(site_url):
             
         port = "443" if scheme == "https" else "80"
         host_id = f"{scheme}:{netloc}:{port}"
-        logger.info(f"Сформирован host_id: {host_id}")
+        logger.info("Сформирован host_id: %s", host_id)
         return host_id
     except Exception as e:
-        logger.error(f"Ошибка при формировании host_id: {e}")
+        logger.error("Ошибка при формировании host_id: %s", e)
         raise
 
 
 def get_yandex_user_id():
     """Получает user-id из API Яндекса"""
     try:
-        response = requests.get(f"{YANDEX_API_BASE}/user", headers=YANDEX_HEADERS)
+        response = yandex_session.get(f"{YANDEX_API_BASE}/user")
         response.raise_for_status()
-        data = response.json()
+        data = orjson.loads(response.content)
+        if not isinstance(data, dict):
+            raise ValueError(f"Неожиданный ответ API: {data}")
         
-        if "user_id" not in data:
+        user_id = data.get("user_id")
+        if user_id is None:
             raise ValueError(f"В ответе API отсутствует user_id: {data}")
             
-        user_id = data["user_id"]
-        logger.info(f"Получен user-id: {user_id}")
+        logger.info("Получен user-id: %s", user_id)
         return user_id
-    except requests.exceptions.RequestException as e:
-        logger.error(f"Ошибка при запросе user-id: {e}")
+    except (requests.exceptions.RequestException, ValueError) as e:
+        logger.error("Ошибка при запросе user-id: %s", e)
         raise
 
 
-def send_reindex_yandex(user_id, host_id, url):
+def retry_after_seconds(exc):
+    """Возвращает паузу из заголовка Retry-After ответа с ошибкой, если она указана в секундах"""
+    if isinstance(exc, httpx.HTTPStatusError):
+        retry_after = exc.response.headers.get("Retry-After", "")
+        if retry_after.isdigit():
+            return int(retry_after)
+    return None
+
+
+def is_retryable(exc):
+    """
+    Проверяет, стоит ли повторить запрос: сетевой сбой или ответ 429/5xx.
+    Если сервер просит ждать дольше RETRY_AFTER_MAX (квота исчерпана), не повторяем,
+    чтобы задача не занимала место в семафоре и не задерживала всю порцию
+    """
+    if isinstance(exc, httpx.HTTPStatusError):
+        if exc.response.status_code not in RETRY_STATUSES:
+            return False
+        retry_after = retry_after_seconds(exc)
+        return retry_after is None or retry_after <= RETRY_AFTER_MAX
+    return isinstance(exc, httpx.TransportError)
+
+
+def backoff_delay(attempt):
+    """Экспоненциальная пауза в секундах после неудачной попытки с номером attempt"""
+    return min(0.8 * 2 ** (attempt - 1), 30)
+
+
+def wait_retry_after(retry_state):
+    """Экспоненциальная пауза перед повтором; если сервер прислал Retry-After, ждем не меньше"""
+    delay = backoff_delay(retry_state.attempt_number)
+    retry_after = retry_after_seconds(retry_state.outcome.exception())
+    if retry_after is not None:
+        delay = max(delay, min(retry_after, RETRY_AFTER_MAX))
+    return delay
+
+
+@retry(
+    retry=retry_if_exception(is_retryable),
+    wait=wait_retry_after,
+    stop=stop_after_attempt(RETRY_ATTEMPTS),
+    reraise=True
+)
+async def post_with_retry(client, url, limiter, cost=1, **kwargs):
+    """
+    Отправляет POST-запрос, повторяя его при временных ошибках API.
+    Каждая попытка расходует cost единиц квоты limiter, в том числе повторы
+    """
+    await limiter.acquire(cost)
+    response = await client.post(url, **kwargs)
+    response.raise_for_status()
+    return response
+
+
+async def send_reindex_yandex(client, limiter, api_url, url):
     """
     Отправляет запрос на переиндексацию URL в Яндексе
     и проверяет успешность отправки запроса
     """
-    payload = {"url": url}
     try:
-        api_url = f"{YANDEX_API_BASE}/user/{user_id}/hosts/{host_id}/recrawl/queue"
-        logger.debug(f"Отправка запроса в Яндекс: {api_url} с данными {payload}")
+        logger.debug("Отправка запроса в Яндекс: %s для %s", api_url, url)
         
-        response = requests.post(
-            api_url, 
-            headers=YANDEX_HEADERS, 
-            json=payload
-        )
-        response.raise_for_status()
+        response = await post_with_retry(client, api_url, limiter, content=orjson.dumps({"url": url}))
         
         # Проверяем содержимое ответа
-        response_data = response.json()
-        logger.debug(f"Яндекс API ответ: {response_data}")
+        response_data = orjson.loads(response.content)
+        logger.debug("Яндекс API ответ: %s", response_data)
         
         # Проверка на наличие ошибок в ответе
-        if "error" in response_data:
-            return "неуспешно", f"Ошибка API: {response_data['error']}"
+        error = response_data.get("error")
+        if error is not None:
+            return "неуспешно", f"Ошибка API: {error}"
         
         # Проверка успешности добавления URL в очередь
-        if "task_id" in response_data:
+        if response_data.get("task_id"):
             return "успешно", None
         else:
             return "успешно (без task_id)", None
             
-    except requests.exceptions.HTTPError as e:
-        error_msg = f"Ошибка HTTP при переиндексации Яндекса: {e}"
-        logger.error(error_msg)
+    except httpx.HTTPStatusError as e:
+        logger.error("Ошибка HTTP при переиндексации Яндекса: %s", e)
         
         # Попытка получить детали ошибки из ответа
         try:
-            error_details = response.json()
-            logger.error(f"Детали ошибки Яндекс API: {error_details}")
-            return "неуспешно", json.dumps(error_details)
+            error_details = orjson.loads(e.response.content)
+            logger.error("Детали ошибки Яндекс API: %s", error_details)
+            return "неуспешно", orjson.dumps(error_details).decode()
         except Exception:
             return "неуспешно", str(e)
             
     except Exception as e:
-        error_msg = f"Неожиданная ошибка при переиндексации Яндекса: {e}"
-        logger.error(error_msg)
+        logger.error("Неожиданная ошибка при переиндексации Яндекса: %s", e)
         return "неуспешно", str(e)
 
 
-def publish_url_google(url, action="URL_UPDATED"):
+def build_google_batch(urls, action, boundary):
+    """Собирает тело пакетного запроса multipart/mixed: по одному вызову publish на каждый URL"""
+    parts = []
+    for index, url in enumerate(urls):
+        parts.append(
+            f"--{boundary}\r\n"
+            "Content-Type: application/http\r\n"
+            "Content-Transfer-Encoding: binary\r\n"
+            f"Content-ID: <url-{index}>\r\n"
+            "\r\n"
+            f"POST {GOOGLE_PUBLISH_PATH}\r\n"
+            "Content-Type: application/json\r\n"
+            "\r\n"
+            f"{orjson.dumps({'url': url, 'type': action}).decode()}\r\n"
+        )
+    parts.append(f"--{boundary}--\r\n")
+    return "".join(parts).encode()
+
+
+def parse_google_batch(response):
     """
-    Отправляет запрос на переиндексацию URL в Google
-    и проверяет успешность отправки запроса
+    Разбирает ответ пакетного запроса Google.
+    Возвращает словарь {индекс URL в пакете: (HTTP-статус, тело ответа)}
     """
-    headers = {
-        "Authorization": f"Bearer {get_access_token()}",
-        "Content-Type": "application/json"
-    }
-    payload = {
-        "url": url,
-        "type": action
-    }
+    message = BytesParser().parsebytes(
+        f"Content-Type: {response.headers['Content-Type']}\r\n\r\n".encode() + response.content
+    )
+    if not message.is_multipart():
+        raise ValueError("Неожиданный формат ответа пакетного запроса Google")
+
+    parts = {}
+    for part in message.get_payload():
+        # Content-ID ответа имеет вид <response-url-N>
+        index = int(part.get("Content-ID", "").strip("<>").rsplit("-", 1)[-1])
+        head, _, body = part.get_payload(decode=True).replace(b"\r\n", b"\n").partition(b"\n\n")
+        status_code = int(head.split(b"\n", 1)[0].split()[1])
+        parts[index] = (status_code, body)
+    return parts
+
+
+def check_google_result(url, status_code, body, action):
+    """Проверяет ответ Google на вызов publish для одного URL из пакета"""
     try:
-        logger.debug(f"Отправка запроса в Google: {GOOGLE_API_BASE} с данными {payload}")
-        
-        response = requests.post(GOOGLE_API_BASE, headers=headers, json=payload)
-        response.raise_for_status()
+        if status_code >= 400:
+            logger.error("Ошибка HTTP %d при переиндексации Google: %s", status_code, url)
+            
+            # Попытка получить детали ошибки из ответа
+            try:
+                error_details = orjson.loads(body)
+                logger.error("Детали ошибки Google API: %s", error_details)
+                return "неуспешно", orjson.dumps(error_details).decode()
+            except Exception:
+                return "неуспешно", f"HTTP {status_code}"
         
         # Проверяем содержимое ответа
-        response_data = response.json()
-        logger.debug(f"Google API ответ: {response_data}")
+        response_data = orjson.loads(body)
+        logger.debug("Google API ответ: %s", response_data)
         
         # Проверка статуса ответа
-        if "urlNotificationMetadata" in response_data:
-            metadata = response_data["urlNotificationMetadata"]
+        metadata = response_data.get("urlNotificationMetadata")
+        if metadata is None:
+            return "неуспешно", "Неожиданный формат ответа от Google API"
+        
+        # Проверка на наличие ошибок в ответе
+        update_type = (metadata.get("latestUpdate") or {}).get("type")
+        if update_type is None or update_type == action:
+            return "успешно", None  # Если нет явных ошибок, считаем успешным
+        return "неуспешно", f"Ожидался тип {action}, получен {update_type}"
             
-            # Проверка на наличие ошибок в ответе
-            if "latestUpdate" in metadata and "type" in metadata["latestUpdate"]:
-                if metadata["latestUpdate"]["type"] == action:
-                    return "успешно", None
+    except Exception as e:
+        logger.error("Неожиданная ошибка при переиндексации Google: %s", e)
+        return "неуспешно", str(e)
+
+
+async def send_google_batch(client, token_lock, limiter, urls, action):
+    """
+    Отправляет пакет вызовов publish одним HTTP-запросом.
+    Возвращает использованный заголовок Authorization и разобранные ответы
+    """
+    await ensure_google_token(client, token_lock)
+    logger.debug("Отправка пакета в Google: %d URL (%s)", len(urls), action)
+    
+    boundary = f"batch_{uuid.uuid4().hex}"
+    content = build_google_batch(urls, action, boundary)
+    headers = {"Content-Type": f"multipart/mixed; boundary={boundary}"}
+    auth_header = client.headers["Authorization"]
+    try:
+        response = await post_with_retry(
+            client, GOOGLE_BATCH_URL, limiter, cost=len(urls), content=content, headers=headers
+        )
+    except httpx.HTTPStatusError as e:
+        if e.response.status_code != 401:
+            raise
+        # Токен отозван раньше срока: получаем новый и повторяем пакет один раз
+        await renew_google_token(client, token_lock, auth_header)
+        auth_header = client.headers["Authorization"]
+        response = await post_with_retry(
+            client, GOOGLE_BATCH_URL, limiter, cost=len(urls), content=content, headers=headers
+        )
+    return auth_header, parse_google_batch(response)
+
+
+async def publish_urls_google(client, token_lock, limiter, urls, action="URL_UPDATED"):
+    """
+    Отправляет запросы на переиндексацию пакета URL в Google одним HTTP-запросом
+    и проверяет успешность каждого. Вызовы, на которые Google ответил 429/5xx,
+    повторяются следующим пакетом после экспоненциальной паузы, а при ответе 401
+    токен один раз обновляется и вызовы повторяются сразу.
+    Возвращает список (статус, ошибка) в порядке urls
+    """
+    results = [None] * len(urls)
+    pending = list(range(len(urls)))  # индексы URL, еще не получивших окончательный ответ
+    token_renewed = False
+    try:
+        for attempt in range(1, RETRY_ATTEMPTS + 1):
+            batch = [urls[i] for i in pending]
+            # Квота Google считается по URL, а не по HTTP-запросам, повторы тоже ее расходуют
+            auth_header, parts = await send_google_batch(client, token_lock, limiter, batch, action)
+            
+            retry_later = []
+            unauthorized = transient = False
+            for index, url_index in enumerate(pending):
+                part = parts.get(index)
+                if part is None:
+                    results[url_index] = ("неуспешно", "Нет ответа на URL в пакетном запросе Google")
+                elif part[0] == 401 and not token_renewed and attempt < RETRY_ATTEMPTS:
+                    retry_later.append(url_index)
+                    unauthorized = True
+                elif part[0] in RETRY_STATUSES and attempt < RETRY_ATTEMPTS:
+                    retry_later.append(url_index)
+                    transient = True
                 else:
-                    return "неуспешно", f"Ожидался тип {action}, получен {metadata['latestUpdate']['type']}"
-            else:
-                return "успешно", None  # Если нет явных ошибок, считаем успешным
-        else:
-            return "неуспешно", "Неожиданный формат ответа от Google API"
+                    results[url_index] = check_google_result(urls[url_index], *part, action)
+            
+            if not retry_later:
+                break
+            pending = retry_later
+            if unauthorized:
+                token_renewed = True
+                await renew_google_token(client, token_lock, auth_header)
+            if transient:
+                delay = backoff_delay(attempt)
+                logger.warning("Google: временная ошибка для %d URL из пакета, повтор через %.1f с", len(pending), delay)
+                await asyncio.sleep(delay)
+        return results
             
-    except requests.exceptions.HTTPError as e:
-        error_msg = f"Ошибка HTTP при переиндексации Google: {e}"
-        logger.error(error_msg)
+    except httpx.HTTPStatusError as e:
+        logger.error("Ошибка HTTP при пакетной переиндексации Google: %s", e)
         
         # Попытка получить детали ошибки из ответа
         try:
-            error_details = response.json()
-            logger.error(f"Детали ошибки Google API: {error_details}")
-            return "неуспешно", json.dumps(error_details)
+            error_details = orjson.loads(e.response.content)
+            logger.error("Детали ошибки Google API: %s", error_details)
+            error = orjson.dumps(error_details).decode()
         except Exception:
-            return "неуспешно", str(e)
+            error = str(e)
             
     except Exception as e:
-        error_msg = f"Неожиданная ошибка при переиндексации Google: {e}"
-        logger.error(error_msg)
-        return "неуспешно", str(e)
+        logger.error("Неожиданная ошибка при пакетной переиндексации Google: %s", e)
+        error = str(e)
+    
+    # URL, по которым ответ получен в предыдущих попытках, сохраняют свой результат
+    return [result if result is not None else ("неуспешно", error) for result in results]
+
+
+def iter_csv_urls(reader, url_idx):
+    """Построчно выдает значения колонки URL, разбирая CSV модулем csv"""
+    for row in reader:
+        yield row[url_idx] if len(row) > url_idx else ""
+
+
+def iter_arrow_urls(input_file, column, url_idx):
+    """
+    Выдает значения колонки URL, разбирая отображенный в память CSV через PyArrow блоками.
+    Строки с другим числом полей PyArrow пропускает, поэтому их URL извлекается модулем csv
+    и выдается на прежнем месте - результат совпадает с iter_csv_urls
+    """
+    irregular_rows = {}  # номер строки -> значение URL
+
+    def keep_irregular_row(row):
+        if row.number < 1:
+            logger.warning("Пропуск строки CSV с неизвестным номером: %s", row.text)
+        else:
+            fields = next(csv.reader(io.StringIO(row.text, newline="")), [])
+            irregular_rows[row.number] = fields[url_idx] if len(fields) > url_idx else ""
+        return "skip"
+
+    with pa.memory_map(input_file) as source:
+        reader = pacsv.open_csv(
+            source,
+            parse_options=pacsv.ParseOptions(
+                newlines_in_values=True,
+                ignore_empty_lines=False,
+                invalid_row_handler=keep_irregular_row
+            ),
+            convert_options=pacsv.ConvertOptions(include_columns=[column], column_types={column: pa.string()})
+        )
+        # Строки нумеруются с 1, первая - заголовок. Пропущенные PyArrow строки
+        # разбираются раньше, чем выдается блок с последующими строками
+        row_number = 1
+        for batch in reader:
+            for url in batch.column(0).to_pylist():
+                row_number += 1
+                while row_number in irregular_rows:
+                    yield irregular_rows.pop(row_number)
+                    row_number += 1
+                yield url
+        for number in sorted(irregular_rows):
+            yield irregular_rows.pop(number)
 
 
-def process_urls(input_file, output_file):
+@contextmanager
+def read_urls(input_file):
     """
-    Обрабатывает список URL из входного файла и записывает результаты в выходной файл
+    Проверяет заголовок входного CSV-файла и возвращает итератор по значениям колонки URL.
+    Если установлен PyArrow, файл разбирается им, иначе модулем csv.
+    Используется как контекстный менеджер, чтобы входной файл закрывался при любой ошибке
     """
-    results = []
+    with open(input_file, mode="r", encoding="utf-8-sig", newline="") as csvfile:
+        reader = csv.reader(csvfile)
+        header = next(reader, [])
+        
+        # Обработка BOM и пробелов в именах полей
+        names = [f.strip().replace("\ufeff", "") for f in header]
+        
+        # Проверка наличия поля URL
+        if "URL" not in names:
+            logger.error("В файле отсутствует колонка 'URL'. Доступные колонки: %s", names)
+            raise ValueError(f"Колонка 'URL' не найдена в {input_file}")
+        url_idx = names.index("URL")
+
+        if pacsv is None:
+            yield iter_csv_urls(reader, url_idx)
+        else:
+            yield iter_arrow_urls(input_file, header[url_idx], url_idx)
 
+
+async def process_urls_async(input_file, output_file):
+    """
+    Обрабатывает список URL из входного файла и записывает результаты в выходной файл.
+    Запросы выполняются параллельно, не более CONCURRENCY одновременно
+    и в пределах квот каждого API; в Google URL отправляются пакетами
+    """
     try:
+        load_cached_token()
+
         # Получаем необходимые идентификаторы для API
         host_id = build_yandex_host_id(SITE_URL)
         user_id = get_yandex_user_id()
-        logger.info(f"Инициализация завершена. User ID: {user_id}, Host ID: {host_id}")
+        logger.info("Инициализация завершена. User ID: %s, Host ID: %s", user_id, host_id)
+        # Адрес очереди переобхода одинаков для всех URL, формируем его один раз
+        yandex_recrawl_url = f"{YANDEX_API_BASE}/user/{user_id}/hosts/{host_id}/recrawl/queue"
     except Exception as e:
-        logger.error(f"Ошибка при инициализации: {e}")
+        logger.error("Ошибка при инициализации: %s", e)
         return
 
     # Проверяем существование входного файла
     if not os.path.exists(input_file):
-        logger.error(f"Входной файл не найден: {input_file}")
+        logger.error("Входной файл не найден: %s", input_file)
         return
 
     try:
-        with open(input_file, mode="r", encoding="utf-8-sig", newline="") as csvfile:
-            reader = csv.DictReader(csvfile)
-            
-            # Обработка BOM и пробелов в именах полей
-            if reader.fieldnames:
-                reader.fieldnames = [f.strip().replace("\ufeff", "") for f in reader.fieldnames]
-            
-            # Проверка наличия поля URL
-            if "URL" not in reader.fieldnames:
-                logger.error(f"В файле отсутствует колонка 'URL'. Доступные колонки: {reader.fieldnames}")
-                return
+        # Результаты пишутся по мере обработки, чтобы не держать их в памяти
+        # и не терять уже полученные при сбое
+        with read_urls(input_file) as input_urls, \
+                open(output_file, mode="w", encoding="utf-8", newline="") as outfile:
+            writer = csv.writer(outfile)
+            writer.writerow(["URL", "Yandex_Status", "Yandex_Error", "Google_Status", "Google_Error"])
 
             total_urls = 0
             processed_urls = 0
-            
-            for row in reader:
-                total_urls += 1
-                url = row.get("URL", "").strip()
-                if not url:
-                    logger.warning(f"Пропуск пустого URL в строке {total_urls}")
-                    continue
-                
-                logger.info(f"Обработка URL [{processed_urls+1}/{total_urls}]: {url}")
-
-                # Отправка запросов на переиндексацию
-                status_yandex, error_yandex = send_reindex_yandex(user_id, host_id, url)
-                status_google, error_google = publish_url_google(url)
-
-                # Сохранение результатов
-                results.append({
-                    "URL": url,
-                    "Yandex_Status": status_yandex,
-                    "Yandex_Error": error_yandex if error_yandex else "",
-                    "Google_Status": status_google,
-                    "Google_Error": error_google if error_google else ""
-                })
-
-                processed_urls += 1
-                logger.info(f"Результат: Яндекс - {status_yandex}, Google - {status_google}")
-                
-                # Пауза между запросами для соблюдения ограничений API
-                sleep(1)
-
-        # Запись результатов в выходной файл
-        with open(output_file, mode="w", encoding="utf-8", newline="") as csvfile:
-            fieldnames = ["URL", "Yandex_Status", "Yandex_Error", "Google_Status", "Google_Error"]
-            writer = csv.DictWriter(csvfile, fieldnames=fieldnames)
-            writer.writeheader()
-            writer.writerows(results)
-
-        logger.info(f"Обработка завершена. Обработано URL: {processed_urls}/{total_urls}")
-        logger.info(f"Результаты записаны в {output_file}")
+
+            # Семафор ограничивает число запросов в работе, лимитеры - расход квот API
+            semaphore = asyncio.Semaphore(CONCURRENCY)
+            yandex_limiter = AsyncLimiter(YANDEX_RATE_LIMIT, 1)
+            google_limiter = AsyncLimiter(GOOGLE_RATE_LIMIT, 60)
+            # Отдельный клиент на каждый API со своими заголовками по умолчанию.
+            # По HTTP/2 параллельные запросы к одному хосту идут через одно соединение
+            limits = httpx.Limits(max_connections=50, max_keepalive_connections=20)
+            timeout = httpx.Timeout(30.0)
+            yandex_client = httpx.AsyncClient(http2=True, limits=limits, timeout=timeout, headers=YANDEX_HEADERS)
+            google_client = httpx.AsyncClient(http2=True, limits=limits, timeout=timeout)
+
+            async with yandex_client, google_client:
+                # Токен получаем заранее, чтобы обработчики не обновляли его наперегонки
+                token_lock = asyncio.Lock()
+                await ensure_google_token(google_client, token_lock)
+
+                async def handle_yandex(url):
+                    nonlocal processed_urls
+                    async with semaphore:
+                        logger.info("Обработка URL: %s", url)
+                        result = await send_reindex_yandex(yandex_client, yandex_limiter, yandex_recrawl_url, url)
+
+                    processed_urls += 1
+                    logger.info("Яндекс [%d] %s: %s", processed_urls, url, result[0])
+                    return result
+
+                # Пакеты Google уходят по одному в порядке порций; асинхронная блокировка
+                # справедлива, а семафор не занимается, пока пакет ждет квоты
+                google_order = asyncio.Lock()
+
+                async def handle_google(batch):
+                    async with google_order:
+                        batch_results = await publish_urls_google(google_client, token_lock, google_limiter, batch)
+
+                    logger.info("Google: обработан пакет из %d URL", len(batch))
+                    return batch_results
+
+                # Порции в работе: (порция, задача Яндекса, задача Google)
+                pending = deque()
+
+                def start_chunk(chunk):
+                    # В порции пары (URL, готовый результат); в API уходят URL без результата
+                    urls = [url for url, result in chunk if result is None]
+                    if not urls:
+                        pending.append((chunk, None, None))
+                        return
+                    # Отправка запросов на переиндексацию: API независимы, поэтому запросы
+                    # в Яндекс и пакет Google выполняются отдельными задачами
+                    pending.append((
+                        chunk,
+                        asyncio.gather(*[handle_yandex(url) for url in urls]),
+                        asyncio.ensure_future(handle_google(urls))
+                    ))
+
+                async def write_oldest_chunk():
+                    chunk, yandex_task, google_task = pending.popleft()
+                    if yandex_task is not None:
+                        sent_results = zip(await yandex_task, await google_task)
+
+                    # Сохранение результатов в порядке входного файла
+                    for url, result in chunk:
+                        (status_yandex, error_yandex), (status_google, error_google) = (
+                            result if result is not None else next(sent_results)
+                        )
+                        logger.info("Результат %s: Яндекс - %s, Google - %s", url, status_yandex, status_google)
+                        writer.writerow([url, status_yandex, error_yandex or "", status_google, error_google or ""])
+                    outfile.flush()
+
+                # Входной файл читается порциями по размеру пакета Google
+                chunk = []
+                seen = set()
+                # Локальные ссылки вместо поиска атрибутов и глобальных имен на каждой строке
+                seen_add = seen.add
+                chunk_append = chunk.append
+                match_url = URL_RE.match
+                try:
+                    for url in input_urls:
+                        total_urls += 1
+                        url = (url or "").strip()
+                        if not url:
+                            logger.warning("Пропуск пустого URL в строке %d", total_urls)
+                            continue
+
+                        # Повторный URL не отправляем, в результатах остается первое вхождение
+                        if url in seen:
+                            logger.info("Пропуск повторного URL в строке %d: %s", total_urls, url)
+                            continue
+                        seen_add(url)
+
+                        if match_url(url):
+                            chunk_append((url, None))
+                        else:
+                            logger.warning("Некорректный URL в строке %d: %s", total_urls, url)
+                            chunk_append((url, INVALID_URL_RESULT))
+
+                        if len(chunk) == GOOGLE_CHUNK_SIZE:
+                            start_chunk(chunk)
+                            chunk = []
+                            chunk_append = chunk.append
+                            if len(pending) >= PENDING_CHUNKS:
+                                await write_oldest_chunk()
+
+                    if chunk:
+                        start_chunk(chunk)
+                    while pending:
+                        await write_oldest_chunk()
+                finally:
+                    # При ошибке не оставляем работающих задач после закрытия клиентов
+                    for _, yandex_task, google_task in pending:
+                        if yandex_task is not None:
+                            yandex_task.cancel()
+                            google_task.cancel()
+
+        logger.info("Обработка завершена. Обработано URL: %d/%d", processed_urls, total_urls)
+        logger.info("Уникальных URL: %d из %d строк", len(seen), total_urls)
+        logger.info("Результаты записаны в %s", output_file)
         
     except Exception as e:
-        logger.error(f"Ошибка при обработке файла: {e}")
+        logger.error("Ошибка при обработке файла: %s", e)
 
 
 if __name__ == "__main__":
@@ -294,5 +788,9 @@ if __name__ == "__main__":
     output_file = "results.csv"
     
     logger.info("Запуск процесса переиндексации URL")
-    process_urls(input_file, output_file)
+    # uvloop.run (uvloop >= 0.18) заменяет устаревшую в Python 3.12 связку install() + asyncio.run
+    if uvloop is not None:
+        uvloop.run(process_urls_async(input_file, output_file))
+    else:
+        asyncio.run(process_urls_async(input_file, output_file))
     logger.info("Процесс завершен")